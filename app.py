@@ -22,6 +22,7 @@ from lib.auth import requires_auth
 from lib.discord import discord_token_for, get_user_info
 from lib.redisIO import RedisIO
 from lib.utils import jsonify
+from workshop.collection import ensure_indexes
 
 if config.SENTRY_DSN is not None:
     sentry_sdk.init(
@@ -105,6 +106,7 @@ errors.register_error_handlers(app)
 
 compendium.reload(mdb)
 elasticsearch.init()
+ensure_indexes(mdb)
 
 if __name__ == '__main__':
     app.run()
@@ -1,19 +1,31 @@
 import abc
 import collections
+import concurrent.futures
 import datetime
 import enum
 import json
+import logging
+import threading
 
 import requests
 from bson import ObjectId
-from flask import current_app
+from flask import current_app, g
+from pymongo import ReturnDocument
 
 import config
 from lib.errors import NotAllowed
 from lib.utils import HelperEncoder
+from workshop.constants import ANALYTICS_BACKLOG_LIMIT, ANALYTICS_TIMEOUT, LISTING_BATCH_SIZE
 from workshop.errors import CollectableNotFound, CollectionNotFound
 from workshop.mixins import EditorMixin, GuildActiveMixin, SubscriberMixin
 
+log = logging.getLogger(__name__)
+
+# analytics events are not needed to serve a request, so they are written in the background
+analytics_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+# bounds the number of queued or running events, so a slow analytics backend cannot grow the queue without limit
+analytics_backlog = threading.BoundedSemaphore(ANALYTICS_BACKLOG_LIMIT)
+
 
 class PublicationState(enum.Enum):
     PRIVATE = 'PRIVATE'
@@ -21,7 +33,69 @@ class PublicationState(enum.Enum):
     PUBLISHED = 'PUBLISHED'
 
 
+def ensure_indexes(mdb):
+    """
+    Creates the indexes the workshop queries rely on. Called once at startup; creating an existing index is a no-op.
+    New queries on these collections should filter on an indexed prefix to avoid collection scans.
+    """
+    # user_owned_ids
+    mdb.workshop_collections.create_index([("owner", 1)])
+    # subscriber-side lookups: is_subscribed, my_subs, guild_active_subs, my_editable_ids, unsubscribe, etc.
+    mdb.workshop_subscriptions.create_index([("subscriber_id", 1), ("type", 1), ("object_id", 1)])
+    # object-side lookups: num_subscribers, num_server_active, get_editor_ids, binding updates, delete
+    mdb.workshop_subscriptions.create_index([("object_id", 1), ("type", 1)])
+
+
+def request_cache():
+    """Returns a dict of workshop objects loaded during the current request, keyed by (type, ObjectId)."""
+    return g.setdefault('_workshop_cache', {})
+
+
+def cached_or_load(kind, _id, load, **links):
+    """
+    Returns the workshop object of the given kind with ID *_id* from the request cache, calling *load()* to construct
+    and cache it on a miss. On a hit, any attributes in *links* (e.g. ``_collection``) that are unset on the cached
+    object are filled in.
+    """
+    cache = request_cache()
+    inst = cache.get((kind, _id))
+    if inst is None:
+        inst = cache[kind, _id] = load()
+    else:
+        for attr, value in links.items():
+            if getattr(inst, attr) is None:
+                setattr(inst, attr, value)
+    return inst
+
+
+def _write_event(mdb, event):
+    """Inserts the analytics event into the database and pushes it to ElasticSearch."""
+    try:
+        es_event = event.copy()  # we make a copy because mdb insert adds an _id field which makes es unhappy
+        mdb.analytics_alias_events.insert_one(event)
+
+        # add a sub_score metric
+        es_event['sub_score'] = 0
+        if es_event['type'] in ('subscribe', 'server_subscribe'):
+            es_event['sub_score'] = 1
+        elif es_event['type'] in ('unsubscribe', 'server_unsubscribe'):
+            es_event['sub_score'] = -1
+
+        requests.post(
+            f"{config.ELASTICSEARCH_ENDPOINT}/workshop_events/_doc",
+            data=json.dumps(es_event, cls=HelperEncoder),
+            headers={"Content-Type": "application/json"},
+            timeout=ANALYTICS_TIMEOUT
+        )
+    except Exception:
+        log.exception(f"Failed to log workshop event {event!r}")
+
+
 class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
+    __slots__ = ('name', 'description', 'image', 'owner', '_aliases', '_snippets', 'publish_state',
+                 'approx_num_subscribers', 'approx_num_guild_subscribers', 'last_edited', 'created_at', 'tags',
+                 'alias_ids', 'snippet_ids')
+
     def __init__(self,
                  _id, name, description, image, owner,
                  alias_ids, snippet_ids,
@@ -88,60 +162,90 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
         return self._snippets
 
     def load_aliases(self):
-        self._aliases = []
-        for alias_id in self.alias_ids:
-            self._aliases.append(WorkshopAlias.from_id(alias_id, collection=self, parent=None))
+        # loads the whole alias tree, since callers (full view, delete) walk subcommands too
+        self._aliases = WorkshopAlias.load_tree(self.alias_ids, collection=self)
         return self._aliases
 
     def load_snippets(self):
-        self._snippets = []
-        for snippet_id in self.snippet_ids:
-            self._snippets.append(WorkshopSnippet.from_id(snippet_id, collection=self))
+        if not self.snippet_ids:
+            self._snippets = []
+            return self._snippets
+        raws = WorkshopSnippet.mdb_coll().find({"_id": {"$in": self.snippet_ids}}).batch_size(len(self.snippet_ids))
+        raws_by_id = {raw['_id']: raw for raw in raws}
+        self._snippets = [
+            cached_or_load("snippet", snippet_id,
+                           lambda: WorkshopSnippet.from_dict(raws_by_id[snippet_id], collection=self),
+                           _collection=self)
+            for snippet_id in self.snippet_ids if snippet_id in raws_by_id
+        ]
         return self._snippets
 
     # constructors
+    @classmethod
+    def from_dict(cls, raw):
+        return cls(raw['_id'], raw['name'], raw['description'], raw['image'], raw['owner'],
+                   raw['alias_ids'], raw['snippet_ids'],
+                   PublicationState(raw['publish_state']), raw['num_subscribers'], raw['num_guild_subscribers'],
+                   raw['last_edited'], raw['created_at'], raw['tags'])
+
     @classmethod
     def from_id(cls, _id):
         if not isinstance(_id, ObjectId):
             _id = ObjectId(_id)
+        return cls._from_id_unchecked(_id)
 
-        raw = current_app.mdb.workshop_collections.find_one({"_id": _id})
-        if raw is None:
-            raise CollectionNotFound()
+    @classmethod
+    def _from_id_unchecked(cls, _id):
+        """Like from_id(), but *_id* must already be an ObjectId. Used when loading IDs read from the database."""
 
-        return cls(raw['_id'], raw['name'], raw['description'], raw['image'], raw['owner'],
-                   raw['alias_ids'], raw['snippet_ids'],
-                   PublicationState(raw['publish_state']), raw['num_subscribers'], raw['num_guild_subscribers'],
-                   raw['last_edited'], raw['created_at'], raw['tags'])
+        def load():
+            raw = current_app.mdb.workshop_collections.find_one({"_id": _id})
+            if raw is None:
+                raise CollectionNotFound()
+            return cls.from_dict(raw)
+
+        return cached_or_load("collection", _id, load)
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        Returns an iterator of WorkshopCollections with the given IDs, in the order given, using a single query.
+        Skips missing collections.
+        """
+        ids = list(ids)
+        if not ids:
+            return
+        cursor = current_app.mdb.workshop_collections.find({"_id": {"$in": ids}})
+        raws_by_id = {raw['_id']: raw for raw in cursor.batch_size(LISTING_BATCH_SIZE)}
+        for coll_id in ids:
+            if coll_id in raws_by_id:
+                yield cached_or_load("collection", coll_id, lambda: cls.from_dict(raws_by_id[coll_id]))
 
     # helpers
     @classmethod
     def user_owned_ids(cls, user_id: int):
         """Returns an iterator of ObjectIds of objects the contextual user owns."""
-        for obj in current_app.mdb.workshop_collections.find({"owner": user_id}, ['_id']):
+        cursor = current_app.mdb.workshop_collections.find({"owner": user_id}, ['_id'])
+        for obj in cursor.batch_size(LISTING_BATCH_SIZE):
             yield obj['_id']
 
     @classmethod
     def user_subscribed(cls, user_id: int):
         """Returns an iterator of WorkshopCollections that the user has subscribed to."""
-        for coll_id in cls.my_sub_ids(user_id):
-            try:
-                yield cls.from_id(coll_id)
-            except CollectionNotFound:
-                continue
+        yield from cls.from_ids(cls.my_sub_ids(user_id))
 
     @classmethod
     def server_subscribed(cls, guild_id: int):
         """Returns an generator of WorkshopCollections that the server has subscribed to."""
-        for coll_id in cls.guild_active_ids(guild_id):
-            try:
-                yield cls.from_id(coll_id)
-            except CollectionNotFound:
-                continue
+        yield from cls.from_ids(cls.guild_active_ids(guild_id))
 
     def is_owner(self, user_id: int):
         return user_id == self.owner
 
+    def uncache(self):
+        """Removes this collection from the request cache, forcing the next from_id() to reload it."""
+        request_cache().pop(("collection", self.id), None)
+
     def to_dict(self, js=False):
         out = {
             "name": self.name, "description": self.description, "image": self.image, "owner": self.owner,
@@ -163,7 +267,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             raise NotAllowed("Name is required.")
         if not description:
             raise NotAllowed("Description is required.")
-        now = datetime.datetime.now()
+        now = datetime.datetime.utcnow()
         # noinspection PyTypeChecker
         # id is None until inserted
         inst = cls(None, name, description, image, user_id, [], [], PublicationState.PRIVATE, 0, 0, now, now, [])
@@ -178,17 +282,22 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             raise NotAllowed("Name is required.")
         if not description:
             raise NotAllowed("Description is required.")
-        current_app.mdb.workshop_collections.update_one(
+        result = current_app.mdb.workshop_collections.find_one_and_update(
             {"_id": self.id},
             {
                 "$set": {"name": name, "description": description, "image": image},
                 "$currentDate": {"last_edited": True}
-            }
+            },
+            projection={"last_edited": True},
+            return_document=ReturnDocument.AFTER
         )
+        if result is None:
+            raise CollectionNotFound()
         self.name = name
         self.description = description
         self.image = image
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = result['last_edited']
+        self.uncache()
         self.update_elasticsearch()
 
     def delete(self):
@@ -206,6 +315,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
         current_app.mdb.workshop_collections.delete_one(
             {"_id": self.id}
         )
+        self.uncache()
 
         # delete subscriptions
         self.sub_coll(current_app.mdb).delete_many({"object_id": self.id})
@@ -218,7 +328,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             {"_id": self.id},
             {"$currentDate": {"last_edited": True}}
         )
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
 
     def set_state(self, new_state):
         """
@@ -253,7 +363,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             }
         )
         self.publish_state = new_state
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
         self.update_elasticsearch()
 
     def create_alias(self, name, docs):
@@ -275,7 +385,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             }
         )
         self.alias_ids.append(result.inserted_id)
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
 
         # update all subscriber bindings
         new_binding = {"name": inst.name, "id": inst.id}
@@ -307,7 +417,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             }
         )
         self.snippet_ids.append(result.inserted_id)
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
 
         # update all subscriber bindings
         new_binding = {"name": inst.name, "id": inst.id}
@@ -335,7 +445,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             }
         )
         self.tags.append(tag)
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
         self.update_elasticsearch()
 
     def remove_tag(self, tag: str):
@@ -351,29 +461,42 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
             }
         )
         self.tags.remove(tag)
-        self.last_edited = datetime.datetime.now()
+        self.last_edited = datetime.datetime.utcnow()
         self.update_elasticsearch()
 
     # bindings
+    @staticmethod
+    def _default_bindings(ids, mdb_coll):
+        """
+        Returns a list of {name: str, id: ObjectId} bindings for the given object IDs, in order, fetching only the
+        names of the objects.
+        """
+        if not ids:
+            return []
+        names = {raw['_id']: raw['name'] for raw in mdb_coll.find({"_id": {"$in": ids}}, {"name": 1})}
+        return [{"name": names[_id], "id": _id} for _id in ids if _id in names]
+
     def _generate_default_alias_bindings(self):
         """
         Returns a list of {name: str, id: ObjectId} bindings based on the default names of aliases in the collection.
         """
-        return [{"name": alias.name, "id": alias.id} for alias in self.aliases]
+        return self._default_bindings(self.alias_ids, WorkshopAlias.mdb_coll())
 
     def _generate_default_snippet_bindings(self):
         """
         Returns a list of {name: str, id: ObjectId} bindings based on the default names of snippets in the collection.
         """
-        return [{"name": snippet.name, "id": snippet.id} for snippet in self.snippets]
+        return self._default_bindings(self.snippet_ids, WorkshopSnippet.mdb_coll())
 
     def _bindings_sanity_check(self, the_ids, the_bindings, binding_cls):
+        the_ids = set(the_ids)
+
         # sanity check: ensure all aliases are in the bindings
         binding_ids = {b['id'] for b in the_bindings}
-        missing_ids = set(the_ids).difference(binding_ids)
-        for missing in missing_ids:
-            obj = binding_cls.from_id(missing, collection=self)
-            the_bindings.append({"name": obj.name, "id": obj.id})
+        missing_ids = the_ids.difference(binding_ids)
+        if missing_ids:
+            raws = binding_cls.mdb_coll().find({"_id": {"$in": list(missing_ids)}}, {"name": 1})
+            the_bindings.extend({"name": raw['name'], "id": raw['_id']} for raw in raws)
 
         # sanity check: ensure all names are valid
         for binding in the_bindings:
@@ -400,6 +523,7 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
         """Updates the contextual author as a subscriber, with given name bindings."""
         if self.publish_state == PublicationState.PRIVATE and not (self.is_owner(user_id) or self.is_editor(user_id)):
             raise NotAllowed("This collection is private.")
+        now = datetime.datetime.utcnow()
 
         # generate default bindings
         if alias_bindings is None:
@@ -421,36 +545,48 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
 
         if result.upserted_id is not None:
             # increase subscription count
-            current_app.mdb.workshop_collections.update_one(
+            updated = current_app.mdb.workshop_collections.find_one_and_update(
                 {"_id": self.id},
-                {"$inc": {"num_subscribers": 1}}
+                {"$inc": {"num_subscribers": 1}},
+                projection={"num_subscribers": True},
+                return_document=ReturnDocument.AFTER
             )
+            if updated is not None:  # None if the collection was deleted concurrently
+                self.approx_num_subscribers = updated['num_subscribers']
             # log subscribe event
             self.log_event(
-                {"type": "subscribe", "object_id": self.id, "timestamp": datetime.datetime.utcnow(), "user_id": user_id}
+                {"type": "subscribe", "object_id": self.id, "timestamp": now, "user_id": user_id}
             )
+            self.uncache()
 
         return {"alias_bindings": alias_bindings, "snippet_bindings": snippet_bindings,
                 "new_subscription": result.upserted_id is not None}
 
     def unsubscribe(self, user_id: int):
+        now = datetime.datetime.utcnow()
         # remove sub doc
         super().unsubscribe(user_id)
         # decr sub count
-        current_app.mdb.workshop_collections.update_one(
+        updated = current_app.mdb.workshop_collections.find_one_and_update(
             {"_id": self.id},
-            {"$inc": {"num_subscribers": -1}}
+            {"$inc": {"num_subscribers": -1}},
+            projection={"num_subscribers": True},
+            return_document=ReturnDocument.AFTER
         )
+        if updated is not None:  # None if the collection was deleted concurrently
+            self.approx_num_subscribers = updated['num_subscribers']
         # log unsub event
         self.log_event(
-            {"type": "unsubscribe", "object_id": self.id, "timestamp": datetime.datetime.utcnow(), "user_id": user_id}
+            {"type": "unsubscribe", "object_id": self.id, "timestamp": now, "user_id": user_id}
         )
+        self.uncache()
 
     def set_server_active(self, guild_id: int, alias_bindings=None, snippet_bindings=None, invoker_id: int = None):
         """Sets the object as active for the contextual guild, with given name bindings."""
         if self.publish_state == PublicationState.PRIVATE \
                 and not (self.is_owner(invoker_id) or self.is_editor(invoker_id)):
             raise NotAllowed("This collection is private.")
+        now = datetime.datetime.utcnow()
 
         # generate default bindings
         if alias_bindings is None:
@@ -472,32 +608,45 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
 
         if result.upserted_id is not None:
             # incr sub count
-            current_app.mdb.workshop_collections.update_one(
+            updated = current_app.mdb.workshop_collections.find_one_and_update(
                 {"_id": self.id},
-                {"$inc": {"num_guild_subscribers": 1}}
+                {"$inc": {"num_guild_subscribers": 1}},
+                projection={"num_guild_subscribers": True},
+                return_document=ReturnDocument.AFTER
             )
+            if updated is not None:  # None if the collection was deleted concurrently
+                self.approx_num_guild_subscribers = updated['num_guild_subscribers']
             # log sub event
             self.log_event(
-                {"type": "server_subscribe", "object_id": self.id, "timestamp": datetime.datetime.utcnow(),
+                {"type": "server_subscribe", "object_id": self.id, "timestamp": now,
                  "user_id": invoker_id}
             )
+            self.uncache()
 
         return {"alias_bindings": alias_bindings, "snippet_bindings": snippet_bindings,
                 "new_subscription": result.upserted_id is not None}
 
     def unset_server_active(self, guild_id: int, invoker_id: int = None):
+        now = datetime.datetime.utcnow()
         # remove sub doc
-        super().unset_server_active(guild_id)
+        if not super().unset_server_active(guild_id):
+            return False
         # decr sub count
-        current_app.mdb.workshop_collections.update_one(
+        updated = current_app.mdb.workshop_collections.find_one_and_update(
             {"_id": self.id},
-            {"$inc": {"num_guild_subscribers": -1}}
+            {"$inc": {"num_guild_subscribers": -1}},
+            projection={"num_guild_subscribers": True},
+            return_document=ReturnDocument.AFTER
         )
+        if updated is not None:  # None if the collection was deleted concurrently
+            self.approx_num_guild_subscribers = updated['num_guild_subscribers']
         # log unsub event
         self.log_event(
-            {"type": "server_unsubscribe", "object_id": self.id, "timestamp": datetime.datetime.utcnow(),
+            {"type": "server_unsubscribe", "object_id": self.id, "timestamp": now,
              "user_id": invoker_id}
         )
+        self.uncache()
+        return True
 
     def update_elasticsearch(self):
         """POSTs the latest version of this collection to ElasticSearch (fire-and-forget)."""
@@ -509,25 +658,19 @@ class WorkshopCollection(SubscriberMixin, GuildActiveMixin, EditorMixin):
 
     @staticmethod
     def log_event(event):
-        """Logs the event and pushes it to ElasticSearch."""
-        es_event = event.copy()  # we make a copy because mdb insert adds an _id field which makes es unhappy
-        current_app.mdb.analytics_alias_events.insert_one(event)
-
-        # add a sub_score metric
-        es_event['sub_score'] = 0
-        if es_event['type'] in ('subscribe', 'server_subscribe'):
-            es_event['sub_score'] = 1
-        elif es_event['type'] in ('unsubscribe', 'server_unsubscribe'):
-            es_event['sub_score'] = -1
-
-        requests.post(
-            f"{config.ELASTICSEARCH_ENDPOINT}/workshop_events/_doc",
-            data=json.dumps(es_event, cls=HelperEncoder),
-            headers={"Content-Type": "application/json"}
-        )
+        """Logs the event and pushes it to ElasticSearch in the background."""
+        if not analytics_backlog.acquire(blocking=False):
+            log.warning(f"Analytics backlog is full, dropping workshop event {event!r}")
+            return
+        # the app context does not follow us into the worker thread, so pass the db handle along
+        future = analytics_executor.submit(_write_event, current_app.mdb, event)
+        future.add_done_callback(lambda _: analytics_backlog.release())
 
 
 class WorkshopCollectableObject(abc.ABC):
+    __slots__ = ('id', 'name', 'code', 'versions', 'docs', 'entitlements', '_collection', '_collection_id',
+                 '_entitlements_by_type', '_short_docs')
+
     def __init__(self, _id, name,
                  code, versions, docs, entitlements, collection_id,
                  collection=None):
@@ -556,12 +699,16 @@ class WorkshopCollectableObject(abc.ABC):
         self.docs = docs
         self.entitlements = entitlements
         self._collection = collection
+        self._entitlements_by_type = None
+        self._short_docs = None
         # lazy-load collection
         self._collection_id = collection_id
 
     @property
     def short_docs(self):
-        return self.docs.split('\n')[0]
+        if self._short_docs is None:
+            self._short_docs = self.docs.partition('\n')[0]
+        return self._short_docs
 
     @property
     def collection(self):
@@ -570,15 +717,25 @@ class WorkshopCollectableObject(abc.ABC):
         return self._collection
 
     def load_collection(self):
-        self._collection = WorkshopCollection.from_id(self._collection_id)
+        self._collection = WorkshopCollection._from_id_unchecked(self._collection_id)
         return self._collection
 
+    @property
+    def entitlements_by_type(self):
+        """
+        A defaultdict of {entity_type: [entity_id]} for required entitlements, built once and cached until the
+        entitlements change. The mapping is shared and must be treated as read-only.
+        """
+        if self._entitlements_by_type is None:
+            out = collections.defaultdict(list)
+            for ent in self.entitlements:
+                out[ent.entity_type].append(ent.entity_id)
+            self._entitlements_by_type = out
+        return self._entitlements_by_type
+
     def get_entitlements(self):
-        """Returns a dict of {entity_type: [entity_id]} for required entitlements."""
-        out = collections.defaultdict(lambda: [])
-        for ent in self.entitlements:
-            out[ent.entity_type].append(ent.entity_id)
-        return out
+        """Returns the cached, read-only defaultdict of {entity_type: [entity_id]} for required entitlements."""
+        return self.entitlements_by_type
 
     def to_dict(self, js=False):
         versions = [cv.to_dict() for cv in self.versions]
@@ -604,12 +761,13 @@ class WorkshopCollectableObject(abc.ABC):
         )
         self.name = name
         self.docs = docs
+        self._short_docs = None
         self.collection.update_edit_time()
 
     def create_code_version(self, content: str):
         """Creates a new inactive code version, incrementing version num and setting creation time."""
         version = max((cv.version for cv in self.versions), default=0) + 1
-        cv = CodeVersion(version, content, datetime.datetime.now(), False)
+        cv = CodeVersion(version, content, datetime.datetime.utcnow(), False)
         self.mdb_coll().update_one(
             {"_id": self.id},
             {"$push": {"versions": cv.to_dict()}}
@@ -661,6 +819,7 @@ class WorkshopCollectableObject(abc.ABC):
         )
         self.collection.update_edit_time()
         self.entitlements.append(re)
+        self._entitlements_by_type = None
         return [e.to_dict() for e in self.entitlements]
 
     def remove_entitlement(self, sourced_entity):
@@ -684,10 +843,13 @@ class WorkshopCollectableObject(abc.ABC):
         )
         self.collection.update_edit_time()
         self.entitlements.remove(existing)
+        self._entitlements_by_type = None
         return [e.to_dict() for e in self.entitlements]
 
 
 class WorkshopAlias(WorkshopCollectableObject):
+    __slots__ = ('_subcommands', '_parent', '_subcommand_ids', '_parent_id')
+
     def __init__(self, _id, name, code, versions, docs, entitlements, collection_id, subcommand_ids, parent_id,
                  collection=None, parent=None):
         """
@@ -719,14 +881,11 @@ class WorkshopAlias(WorkshopCollectableObject):
         return self._subcommands
 
     def load_parent(self):
-        self._parent = WorkshopAlias.from_id(self._parent_id, collection=self._collection)
+        self._parent = WorkshopAlias._from_id_unchecked(self._parent_id, collection=self._collection)
         return self._parent
 
     def load_subcommands(self):
-        self._subcommands = []
-        for subcommand_id in self._subcommand_ids:
-            self._subcommands.append(
-                WorkshopAlias.from_id(subcommand_id, collection=self._collection, parent=self))
+        self._subcommands = WorkshopAlias.load_tree(self._subcommand_ids, collection=self._collection, parent=self)
         return self._subcommands
 
     @staticmethod
@@ -741,15 +900,53 @@ class WorkshopAlias(WorkshopCollectableObject):
         return cls(raw['_id'], raw['name'], raw['code'], versions, raw['docs'], entitlements, raw['collection_id'],
                    raw['subcommand_ids'], raw['parent_id'], collection, parent)
 
+    @classmethod
+    def load_tree(cls, root_ids, collection=None, parent=None):
+        """
+        Loads the aliases with the given IDs and all of their nested subcommands, and returns the root aliases in the
+        order of *root_ids*. Runs one query per level of the tree rather than one per alias.
+        """
+        roots = []
+        # (parent alias, IDs of its children to load, list to load them into)
+        pending = [(parent, root_ids, roots)]
+        while pending:
+            ids = [alias_id for _, child_ids, _ in pending for alias_id in child_ids]
+            if not ids:
+                break
+            raws = {raw['_id']: raw for raw in cls.mdb_coll().find({"_id": {"$in": ids}}).batch_size(len(ids))}
+
+            next_pending = []
+            for the_parent, child_ids, out in pending:
+                for alias_id in child_ids:
+                    raw = raws.get(alias_id)
+                    if raw is None:
+                        continue
+                    inst = cached_or_load("alias", alias_id, lambda: cls.from_dict(raw, collection, the_parent),
+                                          _collection=collection, _parent=the_parent)
+                    if inst._subcommands is None:
+                        inst._subcommands = []
+                        next_pending.append((inst, inst._subcommand_ids, inst._subcommands))
+                    out.append(inst)
+            pending = next_pending
+        return roots
+
     @classmethod
     def from_id(cls, _id, collection=None, parent=None):
         if not isinstance(_id, ObjectId):
             _id = ObjectId(_id)
+        return cls._from_id_unchecked(_id, collection, parent)
+
+    @classmethod
+    def _from_id_unchecked(cls, _id, collection=None, parent=None):
+        """Like from_id(), but *_id* must already be an ObjectId. Used when loading IDs read from the database."""
+
+        def load():
+            raw = cls.mdb_coll().find_one({"_id": _id})
+            if raw is None:
+                raise CollectableNotFound()
+            return cls.from_dict(raw, collection, parent)
 
-        raw = cls.mdb_coll().find_one({"_id": _id})
-        if raw is None:
-            raise CollectableNotFound()
-        return cls.from_dict(raw, collection, parent)
+        return cached_or_load("alias", _id, load, _collection=collection, _parent=parent)
 
     def to_dict(self, js=False):
         out = super().to_dict(js)
@@ -817,22 +1014,37 @@ class WorkshopAlias(WorkshopCollectableObject):
         self.mdb_coll().delete_one(
             {"_id": self.id}
         )
+        request_cache().pop(("alias", self.id), None)
 
 
 class WorkshopSnippet(WorkshopCollectableObject):
+    __slots__ = ()
+
+    # constructors
+    @classmethod
+    def from_dict(cls, raw, collection=None):
+        versions = [CodeVersion.from_dict(cv) for cv in raw['versions']]
+        entitlements = [RequiredEntitlement.from_dict(ent) for ent in raw['entitlements']]
+        return cls(raw['_id'], raw['name'], raw['code'], versions, raw['docs'], entitlements,
+                   raw['collection_id'], collection)
+
     @classmethod
     def from_id(cls, _id, collection=None):
         if not isinstance(_id, ObjectId):
             _id = ObjectId(_id)
+        return cls._from_id_unchecked(_id, collection)
 
-        raw = current_app.mdb.workshop_snippets.find_one({"_id": _id})
-        if raw is None:
-            raise CollectableNotFound()
+    @classmethod
+    def _from_id_unchecked(cls, _id, collection=None):
+        """Like from_id(), but *_id* must already be an ObjectId. Used when loading IDs read from the database."""
 
-        versions = [CodeVersion.from_dict(cv) for cv in raw['versions']]
-        entitlements = [RequiredEntitlement.from_dict(ent) for ent in raw['entitlements']]
-        return cls(raw['_id'], raw['name'], raw['code'], versions, raw['docs'], entitlements,
-                   raw['collection_id'], collection)
+        def load():
+            raw = cls.mdb_coll().find_one({"_id": _id})
+            if raw is None:
+                raise CollectableNotFound()
+            return cls.from_dict(raw, collection)
+
+        return cached_or_load("snippet", _id, load, _collection=collection)
 
     @staticmethod
     def mdb_coll():
@@ -865,9 +1077,12 @@ class WorkshopSnippet(WorkshopCollectableObject):
         self.mdb_coll().delete_one(
             {"_id": self.id}
         )
+        request_cache().pop(("snippet", self.id), None)
 
 
 class CodeVersion:
+    __slots__ = ('version', 'content', 'created_at', 'is_current')
+
     def __init__(self, version, content, created_at, is_current):
         """
         :param version: The version of code.
@@ -886,7 +1101,7 @@ class CodeVersion:
 
     @classmethod
     def from_dict(cls, raw):
-        return cls(**raw)
+        return cls(raw['version'], raw['content'], raw['created_at'], raw['is_current'])
 
     def to_dict(self):
         return {
@@ -897,6 +1112,7 @@ class CodeVersion:
 
 class RequiredEntitlement:
     """An entitlement that a user must have to invoke this alias/snippet."""
+    __slots__ = ('entity_type', 'entity_id', 'required')
 
     def __init__(self, entity_type, entity_id, required=False):
         """
@@ -910,7 +1126,7 @@ class RequiredEntitlement:
 
     @classmethod
     def from_dict(cls, raw):
-        return cls(**raw)
+        return cls(raw['entity_type'], raw['entity_id'], raw.get('required', False))
 
     def to_dict(self):
         return {
@@ -3,3 +3,8 @@ UVAR_SIZE_LIMIT = 10_000
 CVAR_SIZE_LIMIT = 10_000
 ALIAS_SIZE_LIMIT = 100_000
 SNIPPET_SIZE_LIMIT = 5_000
+
+LISTING_BATCH_SIZE = 100
+
+ANALYTICS_TIMEOUT = 5  # seconds
+ANALYTICS_BACKLOG_LIMIT = 1000
@@ -6,6 +6,8 @@ from lib.errors import NotAllowed
 
 
 class MixinBase(abc.ABC):
+    __slots__ = ('id',)
+
     def __init__(self, oid):
         """
         :type oid: :class:`bson.ObjectId`
@@ -24,6 +26,7 @@ class MixinBase(abc.ABC):
 
 class SubscriberMixin(MixinBase, abc.ABC):
     """A mixin that offers subscription support."""
+    __slots__ = ()
 
     def is_subscribed(self, user_id: int):
         """Returns whether the user is subscribed to this object."""
@@ -41,12 +44,15 @@ class SubscriberMixin(MixinBase, abc.ABC):
 
     def unsubscribe(self, user_id: int):
         """Removes the user from subscribers."""
-        if not self.is_subscribed(user_id):
+        result = self.sub_coll(current_app.mdb).delete_one(
+            {"type": "subscribe", "subscriber_id": user_id, "object_id": self.id}
+        )
+        if not result.deleted_count:
             raise NotAllowed("You are not subscribed to this.")
 
+        # unactive
         self.sub_coll(current_app.mdb).delete_many(
-            {"type": {"$in": ["subscribe", "active"]}, "subscriber_id": user_id, "object_id": self.id}
-            # unsubscribe, unactive
+            {"type": "active", "subscriber_id": user_id, "object_id": self.id}
         )
 
     def num_subscribers(self):
@@ -73,6 +79,7 @@ class SubscriberMixin(MixinBase, abc.ABC):
 
 class GuildActiveMixin(MixinBase, abc.ABC):
     """A mixin that offers guild active support."""
+    __slots__ = ()
 
     def is_server_active(self, guild_id: int):
         """Returns whether the object is active on this server."""
@@ -95,9 +102,10 @@ class GuildActiveMixin(MixinBase, abc.ABC):
             {"type": "server_active", "subscriber_id": guild_id, "object_id": self.id})
 
     def unset_server_active(self, guild_id: int):
-        """Sets the object as inactive for the contextual guild."""
-        self.sub_coll(current_app.mdb).delete_many(
+        """Sets the object as inactive for the contextual guild. Returns whether the object was active."""
+        result = self.sub_coll(current_app.mdb).delete_many(
             {"type": "server_active", "subscriber_id": guild_id, "object_id": self.id})
+        return result.deleted_count > 0
 
     def num_server_active(self):
         """Returns the number of guilds that have this object active."""
@@ -123,6 +131,7 @@ class GuildActiveMixin(MixinBase, abc.ABC):
 
 class EditorMixin(MixinBase, abc.ABC):
     """A mixin that offers editor tracking."""
+    __slots__ = ()
 
     def is_editor(self, user_id: int):
         """Returns whether the given user can edit this object."""